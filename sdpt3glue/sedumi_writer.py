@@ -12,12 +12,18 @@ Functions which express problems in Sedumi format and export them as .mat files
 for Matlab
 """
 
+import heapq
 import os
 
 import numpy as np
 import scipy.io
+import scipy.sparse
 
-from cvxopt import matrix as cvxmat
+try:
+    from cvxopt import spmatrix as cvxspmat
+except ImportError:
+    # cvxopt is only needed to recognize problem data produced by it
+    cvxspmat = None
 
 
 def write_cvxpy_to_mat(problem_data, target, simplify=True):
@@ -48,9 +54,11 @@ def write_sedumi_to_mat(A, b, c, K, target):
     Effect:
         Saves a .mat file containing A, b, c, K to target
     '''
-    A = sparsify_tall_mat(A)
-    b = sparsify_tall_mat(b)
-    c = sparsify_tall_mat(c)
+    # Matlab stores sparse matrices in CSC form, so savemat can write these
+    # without converting them again.
+    A = _as_csc(A)
+    b = _as_csc(b)
+    c = _as_csc(c)
     K = clean_K_dims(K)
 
     # Check that target folder exists
@@ -61,6 +69,16 @@ def write_sedumi_to_mat(A, b, c, K, target):
     scipy.io.savemat(target, {'A': A, 'b': b, 'c': c, 'K': K})
 
 
+def _as_csc(M):
+    '''
+    Returns M as a float scipy.sparse.csc_matrix, converting sparse matrices
+    directly and going through sparsify_tall_mat for dense ones.
+    '''
+    if scipy.sparse.issparse(M):
+        return scipy.sparse.csc_matrix(M, dtype=np.float64)
+    return sparsify_tall_mat(M).tocsc()
+
+
 def clean_K_dims(K):
     '''
     Matlab requires the dimensions to be given in floating point numbers,
@@ -81,36 +99,70 @@ def problem_data_prep(problem_data):
     '''
     'Touch up' the problem data in the following ways:
       - Make sure the matrix elements aren't integers
-      - Make sure they're dense matrices rather than sparse ones, otherwise
-        there seem to be difficulties constructing block matrices
-      - Transpose c to be a row vector, which matches the organization of A, b, G, h
-        (rows are for constraints, columns are for variables)
-    '''
-    problem_data['A'] = cvxmat(1. * problem_data['A'])
-    problem_data['b'] = cvxmat(1. * problem_data['b'])
-    problem_data['G'] = cvxmat(1. * problem_data['G'])
-    problem_data['h'] = cvxmat(1. * problem_data['h'])
-    problem_data['c'] = cvxmat(1. * problem_data['c']).T
+      - Convert A and G to scipy.sparse.csc_matrix if they're sparse (cvxopt
+        or scipy) and to numpy arrays otherwise, without densifying them
+      - Make b, h and c dense, with b and h column vectors and c a row
+        vector, which matches the organization of A, b, G, h (rows are for
+        constraints, columns are for variables)
+    '''
+    for key in ('A', 'G'):
+        problem_data[key] = _as_float_matrix(problem_data[key])
+    for key in ('b', 'h', 'c'):
+        vector = _as_float_matrix(problem_data[key])
+        if scipy.sparse.issparse(vector):
+            vector = vector.toarray()
+        problem_data[key] = vector
+    problem_data['b'] = problem_data['b'].reshape(-1, 1)
+    problem_data['h'] = problem_data['h'].reshape(-1, 1)
+    problem_data['c'] = problem_data['c'].reshape(1, -1)
     return problem_data
 
 
+def _as_float_matrix(M):
+    '''
+    Returns M as a scipy.sparse.csc_matrix if it's sparse, or as a numpy array
+    otherwise.  Integer elements are converted to float64; a matrix which is
+    already floating point isn't copied.
+    '''
+    if cvxspmat is not None and isinstance(M, cvxspmat):
+        colptr, rowind, values = M.CCS
+        M = scipy.sparse.csc_matrix(
+            (np.asarray(values).ravel(),
+             np.asarray(rowind).ravel(),
+             np.asarray(colptr).ravel()),
+            shape=M.size)
+    elif scipy.sparse.issparse(M):
+        M = scipy.sparse.csc_matrix(M)
+    else:
+        M = np.asarray(M)
+    if not np.issubdtype(M.dtype, np.floating):
+        M = M.astype(np.float64)
+    return M
+
+
 def make_sedumi_format_problem(problem_data, simplify=True):
     '''
     Input:
         problem_data: As produced by applying get_problem_data['CVXOPT'] to a
         cvxpy problem.
     Returns:
-        A, b, c, K: Data defining an equivalent problem in Sedumi format.
+        A, b, c, K: Data defining an equivalent problem in Sedumi format,
+        with A as a scipy.sparse.csr_matrix and b, c as dense column and row
+        vectors.
+        obj_cst: A constant which must be added to the optimal value of the
+        Sedumi problem to make it equivalent (always 0, since the
+        simplification is done with allow_nonzero_b=False).
     '''
     problem_data = problem_data_prep(problem_data)
     dims = problem_data['dims']
     assert not dims[
         'q'], "Sorry, at this time we can't handle SOC constraints!"
 
-    nx = len(problem_data['c'])
+    nx = problem_data['c'].size
     ni = dims['l']
-    ne = len(problem_data['b'])
-    num_sdp_vars = sum([s * s for s in dims['s']])
+    ne = problem_data['b'].shape[0]
+    s_arr = np.asarray(dims['s'], dtype=np.int64)
+    num_sdp_vars = int(s_arr.dot(s_arr))
 
 #==============================================================================
 #   EXPANSION STEP:
@@ -130,23 +182,20 @@ def make_sedumi_format_problem(problem_data, simplify=True):
     c = np.zeros((1, num_sedumi_vars))
     c[0, 0:nx] = problem_data['c']
 
-    A = np.zeros((ne + ni + num_sdp_vars, num_sedumi_vars))
     b = np.zeros((ne + ni + num_sdp_vars, 1))
-
-    # Fill in blocks for Ax = b constraints
-    A[0:ne, 0:nx] = problem_data['A']
     b[0:ne] = problem_data['b']
-
-    # Fill in blocks for Gx + s = h
-    A[ne:ne + ni, 0:nx] = problem_data['G'][:ni, :]  # = Gl
-    A[ne:ne + ni, nx:nx + ni] = np.eye(ni)
     b[ne:ne + ni] = problem_data['h'][:ni, :]  # = hl
-
-    # Fill out blocks defining h - Gs = vec(Y), where Y is the PSD matrix
-    A[ne + ni:, 0:nx] = problem_data['G'][ni:, :]  # = Gs
-    A[ne + ni:, nx + ni:] = np.eye(num_sdp_vars)
     b[ne + ni:] = problem_data['h'][ni:, :]  # = hs
 
+    # A is assembled from sparse blocks so that the (mostly zero) expanded
+    # matrix is never allocated densely.
+    A = scipy.sparse.bmat(
+        [[problem_data['A'], None, None],
+         [problem_data['G'][:ni, :], scipy.sparse.eye(ni), None],  # = Gl
+         [problem_data['G'][ni:, :], None,  # = Gs
+          scipy.sparse.eye(num_sdp_vars)]],
+        format='csr')
+
     obj_cst = 0.
     K = {'f': nx, 'l': dims['l'], 'q': [], 's': dims['s']}
     if simplify:
@@ -164,23 +213,36 @@ def make_sedumi_format_problem(problem_data, simplify=True):
 def symmetrize_sedumi_model(A, b, c, K):
     '''
     Symmetrize sedumi model.
+
+    The columns (and objective coefficients) of each off-diagonal pair of PSD
+    matrix entries are replaced by their average, which is done as a single
+    product with a block diagonal averaging matrix.  The PSD matrix variables
+    are the last columns of A.
     '''
-    colstart = K['f'] + K['l'] + sum(K['q'])
-    for s in K['s']:
-        for i in range(s):
-            for j in range(i + 1, s):
-                ijcol = colstart + i * s + j
-                jicol = colstart + j * s + i
-                averaged_Acol = 0.5 * (A[:, ijcol] + A[:, jicol])
-                A[:, ijcol] = averaged_Acol
-                A[:, jicol] = averaged_Acol
-                averaged_c = 0.5 * (c[0, ijcol] + c[0, jicol])
-                c[0, ijcol] = averaged_c
-                c[0, jicol] = averaged_c
-        colstart += s**2
+    s_arr = np.asarray(K['s'], dtype=np.int64)
+    n_other = c.size - int(s_arr.dot(s_arr))
+    averager = scipy.sparse.block_diag(
+        [scipy.sparse.eye(n_other)] +
+        [_psd_block_averager(s) for s in K['s']],
+        format='csc')
+
+    A = _clean_csr(scipy.sparse.csr_matrix(A).dot(averager))
+    c = averager.T.dot(np.asarray(c).T).T
     return A, b, c, K
 
 
+def _psd_block_averager(s):
+    '''
+    Returns the (s*s, s*s) matrix which, multiplied on the right, averages the
+    columns for entries (i, j) and (j, i) of an s x s PSD matrix variable.
+    '''
+    vec_index = np.arange(s * s)
+    transposed = vec_index.reshape(s, s).T.ravel()
+    swap = scipy.sparse.coo_matrix((np.ones(s * s), (vec_index, transposed)),
+                                   shape=(s * s, s * s))
+    return 0.5 * (scipy.sparse.eye(s * s) + swap)
+
+
 def simplify_sedumi_model(A, b, c, K, allow_nonzero_b=False):
     '''
     Tries to eliminate variables using a few simple strategies:
@@ -197,18 +259,22 @@ def simplify_sedumi_model(A, b, c, K, allow_nonzero_b=False):
         allow_nonzero_b: If False, only eliminate if bk = 0 is zero
 
     Returns:
-        A, b, c, K: for the simplified problem.
+        A, b, c, K: for the simplified problem, with A as a
+        scipy.sparse.csr_matrix.
         offset: A constant which must be added to the optimal value of the
         simplified problem in order to make it equivalent.  With
         allow_nonzero_b, offset will be 0.
     '''
+    A = _clean_csr(scipy.sparse.csr_matrix(A, dtype=np.float64))
+    b = np.array(b, dtype=np.float64)
+    c = np.array(c, dtype=np.float64)
+
     n_free = K['f']  # the first n_free variables will be eligible for any kind
     # of elimination
     n_nonneg = K['l']  # the next n_nonneg variables will be eligible for only
     # the simplest substitution aij*xj=bi and only in the case
     # where bi/aij >=0.
     n_vars = c.size
-    n_ctr = b.size
 
 #==============================================================================
 #   SIMPLICATION STEP:
@@ -224,79 +290,104 @@ def simplify_sedumi_model(A, b, c, K, allow_nonzero_b=False):
 #   SIMPLIFICATION PART ONE: Remove dependence on some cols and mark them for removal.
 #==============================================================================
     offset = 0
-    # Given var_i which is a free variable, figure out if there is a row k of
-    # G_star such that Gs_star[ctr_k, var_i] == -1 AND hs[ctr_k] == 0 AND the
-    # only other non-zero element in the row is Gs_star[ctr_k, nx + ni +
-    # ctr_k] == 1
-    for ctr_k in range(n_ctr):
-        i, j = check_eliminatibility(A[ctr_k, :],
-                                     b[ctr_k, 0],
-                                     n_elig=n_free + n_nonneg,
-                                     allow_nonzero_b=allow_nonzero_b)
+    # The ctrs are considered in order, exactly as if each elimination were
+    # applied as soon as it is found.  Instead, each elimination is recorded
+    # as a substitution, and they are all applied at the end as one sparse
+    # product.  A ctr which uses an eliminated variable is checked as it
+    # will be once the substitutions are applied.
+    is_pending = np.zeros(n_vars, dtype=bool)  # eliminated
+    # x_i is replaced by sub_b[i] - sub_A[i] * x_sub_j[i]
+    sub_j = np.full(n_vars, -1, dtype=int)
+    sub_b = np.zeros(n_vars)
+    sub_A = np.zeros(n_vars)
+    elim_i, elim_j = screen_eliminatibility(
+        A, b, n_elig=n_free + n_nonneg, allow_nonzero_b=allow_nonzero_b)
+    A_csc = A.tocsc()
+
+    wave_k, wave_i = [], []
+    # ctrs left to check: the candidates, plus those using an eliminated
+    # variable.
+    to_check = list(np.flatnonzero(elim_i >= 0))
+    last_k = -1
+    while to_check:
+        k = heapq.heappop(to_check)
+        if k == last_k:
+            continue
+        last_k = k
+
+        row_start, row_end = A.indptr[k], A.indptr[k + 1]
+        cols = A.indices[row_start:row_end]
+        vals = A.data[row_start:row_end]
+        bk = b[k, 0]
+        if is_pending[cols].any():
+            cols, vals, bk = _substitute_wave(cols, vals, bk, is_pending,
+                                              sub_j, sub_b, sub_A)
+            fits = (1 <= cols.size <= 2 and cols[0] < n_free + n_nonneg
+                    and (allow_nonzero_b or bk == 0))
+            i = cols[0] if fits else -1
+            j = cols[1] if fits and cols.size == 2 else -1
+        else:
+            i, j = elim_i[k], elim_j[k]
+        if i < 0:
+            continue
+
+        aki = vals[0]
         # Two cases where we can eliminate xi:
         # 1) xi is a free var
-        free_ok = (i is not None and i < n_free)
-        # 2) xi is a nonneg var, the ctr is of form Akixi = bk, and bk/Aki >= 0
-        nonneg_ok = (i is not None and j is None and 1. *
-                     b[ctr_k, 0] / A[ctr_k, i] >= 0)
-
-        if free_ok or nonneg_ok:
-            aki = A[ctr_k, i]
-            bk = b[ctr_k, 0]
-            factor = 1. * bk / aki
-
-            # Akixi (optionally + Akjxj) = bk case, eliminate xi using
-            # xi = (Akj/Aki) - (bk/Aki)*x_j
-            b[:, 0] += -factor * A[:, i]
-            offset += factor * c[0, i]
-
-            if j is not None:
-                # Akixi + Akjxj = bk case
-                akj = A[ctr_k, j]
-                factor = 1. * akj / aki
-                A[:, j] += -factor * A[:, i]
-                c[0, j] += -factor * c[0, i]
-
-            # zero out the coefficients of var i to make sure it isn't chosen
-            # for elimination again
-            A[:, i] *= 0.
-            c[0, i] *= 0.
+        free_ok = i < n_free
+        # 2) xi is a nonneg var, the ctr is of form Akixi = bk, and
+        # bk/Aki >= 0
+        nonneg_ok = j < 0 and 1. * bk / aki >= 0
+        if not (free_ok or nonneg_ok):
+            continue
+
+        # Akixi (optionally + Akjxj) = bk case, eliminate xi using
+        # xi = (bk/Aki) - (Akj/Aki)*x_j.  Earlier substitutions in terms of
+        # xi are left as they are, and resolved when they are used.
+        wave_k.append(k)
+        wave_i.append(i)
+        is_pending[i] = True
+        sub_b[i] = 1. * bk / aki
+        if j >= 0:
+            # Akixi + Akjxj = bk case
+            sub_j[i] = j
+            sub_A[i] = vals[1] / aki
+        col_rows = A_csc.indices[A_csc.indptr[i]:A_csc.indptr[i + 1]]
+        for later_k in col_rows[col_rows > k]:
+            heapq.heappush(to_check, later_k)
+
+    if wave_i:
+        A, b, c, offset = _apply_elimination_wave(
+            A_csc, A, b, c, wave_k, wave_i, is_pending, sub_j, sub_b, sub_A)
 
     # To wrap up, list all the variables which are still nontrivial to the
     # model
-    n_deleted_f = 0
-    n_deleted_l = 0
-    cols_to_keep = []
+    unused = A.getnnz(axis=0) == 0
+    col = np.arange(n_vars)
     vars_fl = n_free + n_nonneg
-    for col in range(vars_fl):
-        # free vars not in constraints must have 0 coeff in obj, else unbounded.
-        # nonneg vars not in constraints must have >=0 coeff in obj, else unbounded.
-        # if a var makes the probblem unbounded, we'll leave it alone and let
-        # the user find out when they actually solve.
-        free_and_deletable = col < n_free and c[0, col] == 0
-        nneg_and_deletable = col >= n_free and col < vars_fl and c[0, col] >= 0
-        if free_and_deletable and not abs(A[:, col]).any():
-            n_deleted_f += 1
-        elif nneg_and_deletable and not abs(A[:, col]).any():
-            n_deleted_l += 1
-        else:
-            cols_to_keep.append(col)
+    # free vars not in constraints must have 0 coeff in obj, else unbounded.
+    # nonneg vars not in constraints must have >=0 coeff in obj, else unbounded.
+    # if a var makes the probblem unbounded, we'll leave it alone and let
+    # the user find out when they actually solve.
+    free_and_deletable = (col < n_free) & (c[0] == 0) & unused
+    nneg_and_deletable = ((col >= n_free) & (col < vars_fl) & (c[0] >= 0) &
+                          unused)
+    n_deleted_f = int(np.count_nonzero(free_and_deletable))
+    n_deleted_l = int(np.count_nonzero(nneg_and_deletable))
+    deletable = free_and_deletable | nneg_and_deletable
 
     # SOC vars eliminatable iff they're not the first var of their vector and
     # they're unused in any ctrs.
     col_start = n_free + n_nonneg
 
     for i, q_size, in enumerate(K['q']):
-        cols_to_keep.append(col_start)
-        for col in range(col_start + 1, col_start + q_size):
-            if c[0, col] == 0 and not abs(A[:, col]).any():
-                K['q'][i] += -1
-            else:
-                cols_to_keep.append(col)
+        cone_cols = slice(col_start + 1, col_start + q_size)
+        deletable[cone_cols] = (c[0, cone_cols] == 0) & unused[cone_cols]
+        K['q'][i] += -int(np.count_nonzero(deletable[cone_cols]))
         col_start += q_size
 
     # All SDP vars kept
-    cols_to_keep += range(col_start, n_vars)
+    cols_to_keep = np.flatnonzero(~deletable)
 
     # Symmetrize the use of PSD matrix variables.  We do this now because it might
     # zero out some additional ctrs which we'll check for next.
@@ -305,18 +396,16 @@ def simplify_sedumi_model(A, b, c, K, allow_nonzero_b=False):
     # Now figure out which ctrs are nontrivial (trivial meaning 0x = 0).
     # Note that A ctr of 0x = b would make the problem infeasible, but in that case
     # we'll leave it in so the user finds it when they solve.
-    rows_to_keep = []
-    for row in range(n_ctr):
-        if b[row, 0] != 0 or abs(A[row, :]).any():
-            rows_to_keep.append(row)
+    rows_to_keep = np.flatnonzero((A.getnnz(axis=1) > 0) | (b[:, 0] != 0))
 #==============================================================================
 #   SIMPLIFICATION STEP PART TWO: construct final matrices with only
 #     the rows/cols we want
 #==============================================================================
-    # new downsized problem
-    A = A[np.ix_(rows_to_keep, cols_to_keep)]
-    b = b[np.ix_(rows_to_keep, [0])]
-    c = c[np.ix_([0], cols_to_keep)]
+    # new downsized problem, slicing the rows of the CSR matrix first so the
+    # column selection only has to go through the remaining nonzeros
+    A = A[rows_to_keep][:, cols_to_keep]
+    b = b[rows_to_keep, :]
+    c = c[:, cols_to_keep]
 
     # problem dimensions
     assert len(cols_to_keep) + n_deleted_f + n_deleted_l
@@ -331,7 +420,8 @@ def check_eliminatibility(g, h, n_elig=None, allow_nonzero_b=False):
     '''
     Tests if constraint :math:`gx = h` fits either pattern :math:`ax_i = d`
     or pattern :math:`ax_i + bx_j = d`, with the requirement that the
-    :math:`x_i` variable be one of the first n_elig variables.
+    :math:`x_i` variable be one of the first n_elig variables.  g may be a
+    dense vector or a 1 x n scipy sparse matrix.
 
     Returns:
        ``i, None`` such that the constraint has the form :math:`ax_i = d` for
@@ -342,40 +432,179 @@ def check_eliminatibility(g, h, n_elig=None, allow_nonzero_b=False):
 
        ``None, None`` if neither pattern applies.
     '''
-    n = len(g)
-
     if n_elig is None:
-        n_elig = n
+        n_elig = g.shape[1] if scipy.sparse.issparse(g) else len(g)
 
     if not allow_nonzero_b and h != 0:
         return None, None
 
-    for i in range(n_elig):
-        if g[i] != 0:
-            j = i + 1
-            while j < n and g[j] == 0:
-                j += 1
-            # having stopped, see which we have found:
-            if j == n:
-                return i, None  # the end of the row
-            elif not abs(g[j + 1:]).any():
-                return i, j  # the second of exactly two nonzero coefficients
-            else:
-                return None, None  # the second of three or more nonzero coefficients
+    if scipy.sparse.issparse(g):
+        nonzeros = np.sort(scipy.sparse.find(g)[1])
+        n_nonzero = nonzeros.size
+    else:
+        # Only ctrs with one or two nonzero coefficients can fit, which
+        # np.count_nonzero tells us without building the list of nonzeros.
+        n_nonzero = np.count_nonzero(g)
+        nonzeros = np.flatnonzero(g) if 0 < n_nonzero <= 2 else None
+
+    if n_nonzero == 0 or n_nonzero > 2 or nonzeros[0] >= n_elig:
+        # either all the eliminatible vars' coeffs are zero, or there are
+        # three or more nonzero coefficients.
+        return None, None
+    elif n_nonzero == 1:
+        return int(nonzeros[0]), None
+    return int(nonzeros[0]), int(nonzeros[1])
+
+
+def screen_eliminatibility(A, b, n_elig, allow_nonzero_b=False):
+    '''
+    Applies the test of check_eliminatibility to every constraint of
+    :math:`Ax = b` at once.
+
+    Args:
+        A: a scipy.sparse.csr_matrix with sorted indices and no explicit zeros
+        b: the right hand side, as a column vector
+        n_elig: only the first n_elig variables may be eliminated
+
+    Returns:
+        elim_i, elim_j: integer arrays with one entry per constraint.  Where
+        the constraint has the form :math:`ax_i = d` they hold ``i, -1``,
+        where it has the form :math:`ax_i + bx_j = d` they hold ``i, j``, and
+        elsewhere ``-1, -1``.
+    '''
+    n_ctr = A.shape[0]
+    row_nnz = np.diff(A.indptr)
+    first = A.indptr[:-1]
+
+    eligible = (row_nnz == 1) | (row_nnz == 2)
+    if not allow_nonzero_b:
+        eligible &= np.asarray(b).ravel() == 0
+    eligible[eligible] = A.indices[first[eligible]] < n_elig
+
+    elim_i = np.full(n_ctr, -1, dtype=int)
+    elim_j = np.full(n_ctr, -1, dtype=int)
+    elim_i[eligible] = A.indices[first[eligible]]
+    pairs = eligible & (row_nnz == 2)
+    elim_j[pairs] = A.indices[first[pairs] + 1]
+    return elim_i, elim_j
 
-    # If nothing's been returned yet, it's because all the eliminatible
-    # vars' coeffs are zero.
-    return None, None
+
+def _substitute_wave(cols, vals, bk, is_pending, sub_j, sub_b, sub_A):
+    '''
+    Takes the ctr :math:`gx = b_k`, with g given by its nonzero columns and
+    values, and returns it in the same form as it will be once each pending
+    :math:`x_i` is replaced by :math:`s^b_i - s^A_i x_{s^j_i}` (just
+    :math:`s^b_i` where :math:`s^j_i < 0`).
+    '''
+    pending = is_pending[cols]
+    used_i = cols[pending]
+    used_vals = vals[pending]
+    _resolve_substitutions(used_i, is_pending, sub_j, sub_b, sub_A)
+    bk = bk - used_vals.dot(sub_b[used_i])
+
+    pairs = sub_j[used_i] >= 0
+    cols, where = np.unique(
+        np.concatenate([cols[~pending], sub_j[used_i[pairs]]]),
+        return_inverse=True)
+    vals = np.bincount(
+        where.ravel(),
+        weights=np.concatenate([vals[~pending],
+                                -used_vals[pairs] * sub_A[used_i[pairs]]]),
+        minlength=cols.size)
+    nonzero = vals != 0
+    return cols[nonzero], vals[nonzero], bk
+
+
+def _resolve_substitutions(used_i, is_pending, sub_j, sub_b, sub_A):
+    '''
+    Rewrites the substitutions of the pending variables used_i so that none
+    of them is in terms of another pending variable.  Where :math:`x_i` was
+    replaced by an expression in :math:`x_j` before :math:`x_j` itself was
+    eliminated, the substitution for :math:`x_j` is composed into the one
+    for :math:`x_i`.  The results are stored, so each chain of substitutions
+    is only followed once.
+    '''
+    linked = used_i[sub_j[used_i] >= 0]
+    for i in linked[is_pending[sub_j[linked]]]:
+        chain = []
+        while sub_j[i] >= 0 and is_pending[sub_j[i]]:
+            chain.append(i)
+            i = sub_j[i]
+        for p in reversed(chain):
+            # x_p = sub_b[p] - sub_A[p] * (sub_b[q] - sub_A[q] * x_sub_j[q])
+            q = sub_j[p]
+            sub_b[p] -= sub_A[p] * sub_b[q]
+            sub_A[p] = -sub_A[p] * sub_A[q]
+            sub_j[p] = sub_j[q]
+
+
+def _apply_elimination_wave(A_csc, A, b, c, wave_k, wave_i, is_pending,
+                            sub_j, sub_b, sub_A):
+    '''
+    Applies a wave of eliminations to A (given both as CSC and CSR), b and c.
+    Each variable :math:`x_i` in wave_i is replaced by
+    :math:`s^b_i - s^A_i x_{s^j_i}`, or just :math:`s^b_i` where
+    :math:`s^j_i < 0`.  Once the substitutions are resolved, none of them is
+    in terms of a variable of the wave, so all the updates can be made with
+    one product each.
+    The ctrs in wave_k, used for the eliminations, become exactly 0x = 0.
+
+    Returns:
+        A, b, c: for the updated problem.
+        offset: The change in the objective's constant term.
+    '''
+    n_vars = A.shape[1]
+    wave_i = np.asarray(wave_i)
+    _resolve_substitutions(wave_i, is_pending, sub_j, sub_b, sub_A)
+    wave_j = sub_j[wave_i]
+    cols_i = A_csc[:, wave_i]
+
+    factors_b = sub_b[wave_i]
+    b = b - cols_i.dot(factors_b).reshape(-1, 1)
+    offset = factors_b.dot(c[0, wave_i])
+
+    # U[e, j] = Akj/Aki for the e-th elimination of the wave
+    pairs = np.flatnonzero(wave_j >= 0)
+    factors_A = sub_A[wave_i[pairs]]
+    U = scipy.sparse.coo_matrix((factors_A, (pairs, wave_j[pairs])),
+                                shape=(wave_i.size, n_vars))
+    A = A - cols_i.dot(U)
+    c = c.copy()
+    np.subtract.at(c[0], wave_j[pairs], factors_A * c[0, wave_i[pairs]])
+
+    # zero out the coefficients of the eliminated vars to make sure they
+    # aren't chosen for elimination again
+    keep_cols = np.ones(n_vars)
+    keep_cols[wave_i] = 0.
+    c[0, wave_i] = 0.
+    keep_rows = np.ones(A.shape[0])
+    keep_rows[wave_k] = 0.
+    b[wave_k, 0] = 0.
+    A = scipy.sparse.diags(keep_rows).dot(A).dot(scipy.sparse.diags(keep_cols))
+    return _clean_csr(A), b, c, offset
+
+
+def _clean_csr(A):
+    '''
+    Returns A as a scipy.sparse.csr_matrix with sorted indices and no explicit
+    zeros.
+    '''
+    A = scipy.sparse.csr_matrix(A)
+    A.sum_duplicates()
+    A.eliminate_zeros()
+    return A
 
 
 def sparsify_tall_mat(M, block_height=1000):
     '''
     Returns a sparse matrix in scipy.sparse.coo_matrix form which is equivalent to M
+
+    block_height is no longer used, since scipy builds the matrix in one pass;
+    it's kept so existing callers don't break.
     '''
-    i = 0
-    spmat_collector = []
-    while i * block_height < M.shape[0]:
-        curr_block = M[i * block_height:(i + 1) * block_height, :]
-        spmat_collector += [scipy.sparse.coo_matrix(curr_block.astype('d'))]
-        i += 1
-    return scipy.sparse.construct.vstack(spmat_collector)
+    if scipy.sparse.issparse(M):
+        return scipy.sparse.coo_matrix(M, dtype=np.float64)
+    M = np.asarray(M)
+    nz_rows, nz_cols = np.nonzero(M)
+    return scipy.sparse.coo_matrix(
+        (M[nz_rows, nz_cols].astype('d'), (nz_rows, nz_cols)), shape=M.shape)
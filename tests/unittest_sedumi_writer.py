@@ -18,6 +18,7 @@ Created on Thu Apr  7 16:22:17 2016
 
 import unittest
 
+import cvxopt
 import numpy as np
 import scipy
 
@@ -60,10 +61,10 @@ class TestSlackSimplification(unittest.TestCase):
         self.assertEqual(len(K['s']), 0)
 
         self.assertTrue(np.allclose(
-            A, np.array([[1, 0, 0, 1],
-                         [0, 1, 0, 0],
-                         [0, 0, 1, 0],
-                         [0, 0, 0, -1]])), "A was {0}".format(A))
+            A.toarray(), np.array([[1, 0, 0, 1],
+                                   [0, 1, 0, 0],
+                                   [0, 0, 1, 0],
+                                   [0, 0, 0, -1]])), "A was {0}".format(A.toarray()))
         self.assertTrue(np.allclose(
             b, np.array([[1.],
                          [-8.],
@@ -108,8 +109,8 @@ class TestFreeSimplification(unittest.TestCase):
         self.assertEqual(K['s'][0], 2)
 
         self.assertTrue(np.allclose(
-            A, np.array([[2., 0., 0.5, 0.5, 0.],
-                         [1., 0., 0.5, 0.5, 1.]])), "A was {0}".format(A))
+            A.toarray(), np.array([[2., 0., 0.5, 0.5, 0.],
+                                   [1., 0., 0.5, 0.5, 1.]])), "A was {0}".format(A.toarray()))
         self.assertTrue(np.allclose(
             b, np.array([[0.],
                          [0.]])), "b was {0}".format(b))
@@ -132,7 +133,7 @@ class TestFreeSimplification(unittest.TestCase):
         self.assertEqual(K['s'][0], 2)
 
         self.assertTrue(np.allclose(
-            A, np.array([[0., 0., 0., 0., 0.25, 0.25, 1.]])), "A was {0}".format(A))
+            A.toarray(), np.array([[0., 0., 0., 0., 0.25, 0.25, 1.]])), "A was {0}".format(A.toarray()))
         self.assertTrue(np.allclose(
             b, np.array([[0.]])), "b was {0}".format(b))
         self.assertTrue(np.allclose(
@@ -180,9 +181,9 @@ class TestQSimplification(unittest.TestCase):
         self.assertEqual(len(K['s']), 0)
 
         self.assertTrue(np.allclose(
-            A, np.array([[2, 0, 0, 0, 4],
-                         [0, 0, 1, 0, 0],
-                         [0, 0, 2, 0, 1]])), "A was {0}".format(A))
+            A.toarray(), np.array([[2, 0, 0, 0, 4],
+                                   [0, 0, 1, 0, 0],
+                                   [0, 0, 2, 0, 1]])), "A was {0}".format(A.toarray()))
         self.assertTrue(np.allclose(
             b, np.array([[1.],
                          [-2.],
@@ -190,6 +191,118 @@ class TestQSimplification(unittest.TestCase):
         self.assertTrue(np.allclose(
             c, np.array([[1., 0., 3., 4., 5.]])), "c was {0}".format(c))
 
+    def test_case_with_psd(self):
+        '''
+        Test that deleting SOC vars doesn't shift which PSD matrix columns are
+        symmetrized.
+        '''
+        A = 1.*np.array([[1, 0, 0, 1, 0, 0]])  # t + z12 = 1
+        b = 1.*np.array([[1]])
+        c = 1.*np.array([[1, 0, 0, 0, 0, 0]])
+        K = {'f': 0, 'l': 0, 'q': [2], 's': [2]}
+        A, b, c, K, offset = sw.simplify_sedumi_model(A, b, c, K,
+                                                      allow_nonzero_b=True)
+        self.assertEqual(offset, 0.)
+        self.assertEqual(K['q'][0], 1)
+        self.assertTrue(np.allclose(
+            A.toarray(), np.array([[1, 0, 0.5, 0.5, 0]])), "A was {0}".format(A.toarray()))
+        self.assertTrue(np.allclose(
+            c, np.array([[1., 0., 0., 0., 0.]])), "c was {0}".format(c))
+
+
+class TestSedumiExpansion(unittest.TestCase):
+    '''
+    Testing the expansion of cvxpy problem data into Sedumi format.
+    '''
+
+    def setUp(self):
+        '''
+        Set up the data for a problem with 2 vars, 1 equality, 1 linear
+        inequality and a 2 x 2 PSD constraint, and the expanded Sedumi problem
+        (before any simplification) it should give.
+        '''
+        self.A = [[1, 2]]  # x1 + 2x2 = 3
+        self.b = [3]
+        self.G = [[1, 0],  # x1 + s1 = 4
+                  [-1, 0],  # [[x1, x2], [x2, 5]] is PSD
+                  [0, -1],
+                  [0, -1],
+                  [0, 0]]
+        self.h = [4, 0, 0, 0, 5]
+        self.c = [1, -1]
+        self.dims = {'l': 1, 'q': [], 's': [2]}
+
+        self.A_star = np.array([[1, 2, 0, 0, 0, 0, 0],
+                                [1, 0, 1, 0, 0, 0, 0],
+                                [-1, 0, 0, 1, 0, 0, 0],
+                                [0, -1, 0, 0, 0.5, 0.5, 0],
+                                [0, -1, 0, 0, 0.5, 0.5, 0],
+                                [0, 0, 0, 0, 0, 0, 1]])
+        self.b_star = np.array([[3.], [4.], [0.], [0.], [0.], [5.]])
+        self.c_star = np.array([[1., -1., 0., 0., 0., 0., 0.]])
+
+    def check_expansion(self, problem_data):
+        '''
+        Check that problem_data expands to the expected Sedumi problem.
+        '''
+        A, b, c, K, offset = sw.make_sedumi_format_problem(problem_data,
+                                                           simplify=False)
+        self.assertEqual(offset, 0)
+        self.assertEqual(K, {'f': 2, 'l': 1, 'q': [], 's': [2]})
+        self.assertTrue(scipy.sparse.issparse(A))
+        self.assertTrue(np.allclose(A.toarray(), self.A_star),
+                        "A was {0}".format(A.toarray()))
+        self.assertTrue(np.allclose(b, self.b_star), "b was {0}".format(b))
+        self.assertTrue(np.allclose(c, self.c_star), "c was {0}".format(c))
+
+    def test_dense_cvxopt(self):
+        '''
+        Test dense cvxopt matrices, as given by cvxpy.
+        '''
+        self.check_expansion({
+            'A': cvxopt.matrix(np.array(self.A, dtype=float)),
+            'b': cvxopt.matrix(np.array(self.b, dtype=float)),
+            'G': cvxopt.matrix(np.array(self.G, dtype=float)),
+            'h': cvxopt.matrix(np.array(self.h, dtype=float)),
+            'c': cvxopt.matrix(np.array(self.c, dtype=float)),
+            'dims': self.dims})
+
+    def test_sparse_cvxopt(self):
+        '''
+        Test cvxopt spmatrix A and G.
+        '''
+        self.check_expansion({
+            'A': cvxopt.sparse(cvxopt.matrix(np.array(self.A, dtype=float))),
+            'b': cvxopt.matrix(np.array(self.b, dtype=float)),
+            'G': cvxopt.sparse(cvxopt.matrix(np.array(self.G, dtype=float))),
+            'h': cvxopt.matrix(np.array(self.h, dtype=float)),
+            'c': cvxopt.matrix(np.array(self.c, dtype=float)),
+            'dims': self.dims})
+
+    def test_numpy_int(self):
+        '''
+        Test integer numpy arrays, with b, h, c as column vectors.
+        '''
+        self.check_expansion({
+            'A': np.array(self.A),
+            'b': np.array(self.b).reshape(-1, 1),
+            'G': np.array(self.G),
+            'h': np.array(self.h).reshape(-1, 1),
+            'c': np.array(self.c).reshape(-1, 1),
+            'dims': self.dims})
+
+    def test_numpy_1d_vectors(self):
+        '''
+        Test b, h, c given as 1-D numpy arrays.
+        '''
+        self.check_expansion({
+            'A': np.array(self.A, dtype=float),
+            'b': np.array(self.b, dtype=float),
+            'G': np.array(self.G, dtype=float),
+            'h': np.array(self.h, dtype=float),
+            'c': np.array(self.c, dtype=float),
+            'dims': self.dims})
+
 
 class TestSWHelpers(unittest.TestCase):
     '''
@@ -205,6 +318,56 @@ class TestSWHelpers(unittest.TestCase):
         M1 = sw.sparsify_tall_mat(M, block_height=5)
         M2 = scipy.sparse.coo_matrix(M)
         self.assertEqual((M1 != M2).nnz, 0)
+        M3 = sw.sparsify_tall_mat(scipy.sparse.csr_matrix(M))
+        self.assertEqual((M3 != M2).nnz, 0)
+
+    def test_screen_eliminatibility(self):
+        '''
+        Test that screen_eliminatibility agrees with check_eliminatibility
+        applied to each row.
+        '''
+        A = np.array([[0, 2, 0, 0, 0],  # x2 = b1
+                      [0, 0, 0, 3, 0],  # x4 = b2, but x4 isn't eligible
+                      [1, 0, 0, 0, -1],  # x1 - x5 = b3
+                      [1, 1, 1, 0, 0],  # three nonzeros
+                      [0, 0, 0, 0, 0]])
+        b = np.array([[0], [0], [1], [0], [0]])
+        for allow_nonzero_b in (False, True):
+            elim_i, elim_j = sw.screen_eliminatibility(
+                scipy.sparse.csr_matrix(A), b, n_elig=3,
+                allow_nonzero_b=allow_nonzero_b)
+            for k in range(A.shape[0]):
+                i, j = sw.check_eliminatibility(
+                    A[k, :], b[k, 0], n_elig=3, allow_nonzero_b=allow_nonzero_b)
+                self.assertEqual(elim_i[k], -1 if i is None else i)
+                self.assertEqual(elim_j[k], -1 if j is None else j)
+                self.assertEqual(
+                    sw.check_eliminatibility(
+                        scipy.sparse.csr_matrix(A[k, :]), b[k, 0], n_elig=3,
+                        allow_nonzero_b=allow_nonzero_b),
+                    (i, j))
+
+    def test_problem_data_prep_sparse_vectors(self):
+        '''
+        Test that problem_data_prep densifies b, h and c given as cvxopt or
+        scipy sparse matrices, while A and G stay sparse.
+        '''
+        problem_data = {
+            'A': cvxopt.spmatrix([1., 2.], [0, 0], [0, 1], (1, 2)),
+            'b': cvxopt.spmatrix([3.], [0], [0], (1, 1)),
+            'G': scipy.sparse.csr_matrix(np.array([[1., 0.], [0., 1.]])),
+            'h': scipy.sparse.csr_matrix(np.array([[0.], [4.]])),
+            'c': cvxopt.spmatrix([5.], [1], [0], (2, 1))}
+        problem_data = sw.problem_data_prep(problem_data)
+
+        self.assertTrue(scipy.sparse.issparse(problem_data['A']))
+        self.assertTrue(scipy.sparse.issparse(problem_data['G']))
+        self.assertIsInstance(problem_data['b'], np.ndarray)
+        self.assertIsInstance(problem_data['h'], np.ndarray)
+        self.assertIsInstance(problem_data['c'], np.ndarray)
+        self.assertTrue(np.allclose(problem_data['b'], np.array([[3.]])))
+        self.assertTrue(np.allclose(problem_data['h'], np.array([[0.], [4.]])))
+        self.assertTrue(np.allclose(problem_data['c'], np.array([[0., 5.]])))
 
     def test_clean_K_dims(self):
         '''